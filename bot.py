@@ -1,39 +1,53 @@
 import discord
 from discord.ext import commands
 import json
+import gzip
+import re
 import os
 import logging
 import sys
 import atexit
 import signal
 import asyncio
-import threading
-import shutil
+import bisect
+import sqlite3
+import tempfile
+import types
+import time
 from datetime import datetime
 from aiohttp import web
 
 # ========== HEALTH CHECK SERVER (for Railway) ==========
-def run_health_server():
-    """Simple HTTP server to keep Railway happy"""
-    async def handle_health(request):
-        return web.Response(text="OK")
-    
-    async def start_server():
-        app = web.Application()
-        app.router.add_get('/', handle_health)
-        app.router.add_get('/health', handle_health)
-        runner = web.AppRunner(app)
-        await runner.setup()
-        site = web.TCPSite(runner, '0.0.0.0', 8080)
+async def handle_health(request):
+    return web.Response(text="OK")
+
+health_runner = None
+
+async def start_health_server():
+    """Simple HTTP server to keep Railway happy (runs on the bot's event loop, see setup_hook)"""
+    global health_runner
+    app = web.Application()
+    app.router.add_get('/', handle_health)
+    app.router.add_get('/health', handle_health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', 8080)
+    # e.g. port already in use - the bot itself must keep running
+    try:
         await site.start()
-        print("✅ Health server running on port 8080")
-        await asyncio.Event().wait()
-    
-    asyncio.run(start_server())
+    except OSError as e:
+        await runner.cleanup()
+        logger.error(f"❌ Health server error: {e}")
+        return
+    health_runner = runner
+    logger.info("✅ Health server running on port 8080")
 
-# Start health server in background
-health_thread = threading.Thread(target=run_health_server, daemon=True)
-health_thread.start()
+async def stop_health_server():
+    """Release port 8080 (called from bot.close)"""
+    global health_runner
+    if health_runner is not None:
+        await health_runner.cleanup()
+        health_runner = None
 
 # ========== CONFIGURATION ==========
 logging.basicConfig(
@@ -43,10 +57,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger('guildstats')
 
+class GuildStatsBot(commands.Bot):
+    async def setup_hook(self):
+        await start_health_server()
+        
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(graceful_shutdown(sig)))
+            except NotImplementedError:  # Windows: bot.run() still handles Ctrl+C
+                pass
+    
+    async def close(self):
+        await stop_health_server()
+        await super().close()
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Members are only needed for players with stats and are fetched on demand
+# (fetch_members), so don't cache or chunk every member of every guild
+bot = GuildStatsBot(
+    command_prefix='!',
+    intents=intents,
+    member_cache_flags=discord.MemberCacheFlags.none(),
+    chunk_guilds_at_startup=False
+)
 bot.remove_command('help')
 
 # ========== CONSTANTS ==========
@@ -56,12 +92,17 @@ AVAILABLE_CLASSES = [
     "Gunslinger", "Warlord"
 ]
 
-CLASS_MAPPING = {}
-for cls in AVAILABLE_CLASSES:
-    cls_lower = cls.lower()
-    CLASS_MAPPING[cls_lower] = cls
-    CLASS_MAPPING[cls_lower.replace(" ", "")] = cls
-    CLASS_MAPPING[cls_lower.replace(" ", "-")] = cls
+# Read-only: accepted spellings (lowercase, no spaces, hyphenated) -> class name,
+# interned so commands and row_to_stats share one object per class
+CLASS_MAPPING = types.MappingProxyType({
+    variant: sys.intern(cls)
+    for cls in AVAILABLE_CLASSES
+    for variant in (cls.lower(), cls.lower().replace(" ", ""), cls.lower().replace(" ", "-"))
+})
+
+# Fallback for input that isn't a CLASS_MAPPING key as typed: reduced to letters
+# only, "Night  Ranger!" still hits "nightranger"
+NON_LETTERS = re.compile(r'[^a-z]')
 
 # ========== ROLE CHECK FUNCTIONS ==========
 def has_high_council_role(ctx):
@@ -90,78 +131,343 @@ def get_storage_path():
         return '/data/user_stats.json'
     return './user_stats.json'
 
-STATS_FILE = get_storage_path()
-logger.info(f"💾 Persistent storage: {STATS_FILE}")
+STATS_FILE = get_storage_path()  # legacy JSON file, only read by the migration
+DB_FILE = STATS_FILE.replace('.json', '.db')
+ON_VOLUME = STATS_FILE.startswith('/data/')  # resolved once, commands never stat /data
+logger.info(f"💾 Persistent storage: {DB_FILE}")
 
-def load_stats():
-    """Load stats from persistent storage"""
-    try:
-        if os.path.exists(STATS_FILE):
-            with open(STATS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logger.info(f"📂 Loaded {len(data)} players")
-                return data
-    except Exception as e:
-        logger.warning(f"Load error: {e}")
-    return {}
+USER_COLUMNS = (
+    'attack', 'defense', 'accuracy', 'character_class', 'legendary_skin',
+    'legendary_familiar', 'total_score', 'updated_at', 'username', 'display_name'
+)
+
+db = sqlite3.connect(DB_FILE, isolation_level=None, check_same_thread=False)
+db.row_factory = sqlite3.Row
+db.execute('PRAGMA journal_mode=WAL')
+db.execute('PRAGMA synchronous=NORMAL')
+# The WAL is our append-only journal; SQLite checkpoints (compacts) it into the
+# database every 1000 pages, this trims the leftover file back down afterwards
+db.execute('PRAGMA journal_size_limit=1048576')
+db.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        attack INTEGER NOT NULL DEFAULT 0,
+        defense INTEGER NOT NULL DEFAULT 0,
+        accuracy INTEGER NOT NULL DEFAULT 0,
+        character_class TEXT,
+        legendary_skin INTEGER NOT NULL DEFAULT 0,
+        legendary_familiar INTEGER NOT NULL DEFAULT 0,
+        total_score INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT,
+        username TEXT,
+        display_name TEXT
+    )
+''')
+db.execute('CREATE INDEX IF NOT EXISTS idx_users_total ON users (total_score DESC)')
+
+def row_to_stats(row):
+    """Convert a users row into the stats dict used by the commands"""
+    data = dict(row)
+    del data['user_id']
+    data['legendary_skin'] = bool(data['legendary_skin'])
+    data['legendary_familiar'] = bool(data['legendary_familiar'])
+    if data['character_class']:
+        data['character_class'] = sys.intern(data['character_class'])
+    return data
+
+def load_users():
+    """Load all players from the database as {user_id: stats}"""
+    return {row['user_id']: row_to_stats(row) for row in db.execute('SELECT * FROM users')}
+
+UPSERT_SQL = (
+    f'INSERT OR REPLACE INTO users (user_id, {", ".join(USER_COLUMNS)}) '
+    f'VALUES ({", ".join("?" * (len(USER_COLUMNS) + 1))})'
+)
 
-def save_stats(stats):
-    """Save stats with backup"""
+def stats_to_row(user_id, data):
+    """Convert a stats dict into a users row for UPSERT_SQL"""
+    return (user_id, *(data.get(col) for col in USER_COLUMNS))
+
+def write_users(rows, deleted_ids=()):
+    """Upsert full rows and delete players in a single transaction"""
     try:
-        # Create directory if needed
-        os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
-        
-        # Backup old file
-        if os.path.exists(STATS_FILE):
-            shutil.copy2(STATS_FILE, STATS_FILE + '.backup')
-        
-        # Atomic write
-        temp_file = STATS_FILE + '.tmp'
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            json.dump(stats, f, indent=2, ensure_ascii=False)
-        os.replace(temp_file, STATS_FILE)
-        
-        logger.info(f"💾 Saved {len(stats)} players")
+        db.execute('BEGIN')
+        db.executemany(UPSERT_SQL, rows)
+        db.executemany('DELETE FROM users WHERE user_id = ?', [(user_id,) for user_id in deleted_ids])
+        db.execute('COMMIT')
         return True
-    except Exception as e:
+    except sqlite3.Error as e:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
         logger.error(f"Save error: {e}")
         return False
 
+def migrate_json_stats():
+    """One-shot import of the old user_stats.json into the database"""
+    try:
+        with open(STATS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.warning(f"Migration load error: {e}")
+        return
+    
+    rows = [
+        stats_to_row(int(user_id), {
+            'attack': user_data.get('attack', 0),
+            'defense': user_data.get('defense', 0),
+            'accuracy': user_data.get('accuracy', 0),
+            'character_class': user_data.get('character_class'),
+            'legendary_skin': bool(user_data.get('legendary_skin', False)),
+            'legendary_familiar': bool(user_data.get('legendary_familiar', False)),
+            'total_score': calculate_total(user_data),
+            'updated_at': user_data.get('updated_at'),
+            'username': user_data.get('username'),
+            'display_name': user_data.get('display_name'),
+        })
+        for user_id, user_data in data.items()
+    ]
+    
+    # Don't start half-migrated: the bot would save new changes, and the next
+    # start's import would overwrite them with the old JSON values
+    if not write_users(rows):
+        logger.error(f"❌ Migration of {STATS_FILE} failed, not starting")
+        sys.exit(1)
+    
+    # synchronous=NORMAL doesn't fsync the commit; the rows must be on disk
+    # before the rename, or a power loss could keep the rename and lose them
+    try:
+        busy = db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Checkpoint error: {e}")
+        busy = True
+    if busy:
+        logger.error(f"❌ Migration of {STATS_FILE} not synced to disk, not starting")
+        sys.exit(1)
+    
+    # Keep the old file around, but never import it twice
+    os.replace(STATS_FILE, STATS_FILE + '.migrated')
+    logger.info(f"📦 Migrated {len(rows)} players from {STATS_FILE}")
+
+# fdatasync skips timestamp-only metadata but still flushes the file size
+fdatasync = getattr(os, 'fdatasync', os.fsync)  # not available on Windows/macOS
+
+def write_file_atomic(path, payload):
+    """Write bytes crash-safely: unique temp file, fdatasync, rename, fsync the directory"""
+    directory = os.path.dirname(path) or '.'
+    # mkstemp opens with O_EXCL, so concurrent writers never share a temp file
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            fdatasync(f.fileno())
+        os.replace(temp_file, path)
+    except BaseException:
+        os.unlink(temp_file)
+        raise
+    
+    # Make the rename itself durable (directories can't be opened on Windows)
+    if os.name == 'posix':
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def write_backup(path, backup):
+    """Write a gzip-compressed JSON backup (runs in a worker thread)"""
+    write_file_atomic(path, gzip.compress(json.dumps(backup, indent=2).encode('utf-8')))
+
 def calculate_total(stats):
     return stats.get('attack', 0) + stats.get('defense', 0) + stats.get('accuracy', 0)
 
+migrate_json_stats()
+
+# ========== IN-MEMORY CACHE ==========
+# This process is the only writer, so the database is read once and every
+# command works on STATS; changed rows are written back in batches.
+STATS = load_users()
+logger.info(f"📂 Loaded {len(STATS)} players")
+
+# Aggregates kept in step with STATS so summaries never scan every player
+TOTAL_POWER = sum(data['total_score'] for data in STATS.values())
+SKIN_COUNT = sum(1 for data in STATS.values() if data['legendary_skin'])
+FAMILIAR_COUNT = sum(1 for data in STATS.values() if data['legendary_familiar'])
+RANKING = sorted((data['total_score'], user_id) for user_id, data in STATS.items())  # ascending
+
+def render_row(data):
+    """Pre-render a player's !list row as (icons, value text)"""
+    icons = ("✨" if data['legendary_skin'] else "") + ("🐉" if data['legendary_familiar'] else "")
+    value = (
+        f"**{data['total_score']:,}** ({data['attack']}/{data['defense']}/{data['accuracy']}) | "
+        f"{data.get('character_class', '❓')}"
+    )
+    return icons, value
+
+ROW_CACHE = {user_id: render_row(data) for user_id, data in STATS.items()}
+
+def _index(user_id, data):
+    """Add a player's stats to the aggregates"""
+    global TOTAL_POWER, SKIN_COUNT, FAMILIAR_COUNT
+    TOTAL_POWER += data['total_score']
+    SKIN_COUNT += bool(data['legendary_skin'])
+    FAMILIAR_COUNT += bool(data['legendary_familiar'])
+    bisect.insort(RANKING, (data['total_score'], user_id))
+    ROW_CACHE[user_id] = render_row(data)
+
+def _unindex(user_id, data):
+    """Remove a player's stats from the aggregates"""
+    global TOTAL_POWER, SKIN_COUNT, FAMILIAR_COUNT
+    TOTAL_POWER -= data['total_score']
+    SKIN_COUNT -= bool(data['legendary_skin'])
+    FAMILIAR_COUNT -= bool(data['legendary_familiar'])
+    del RANKING[bisect.bisect_left(RANKING, (data['total_score'], user_id))]
+    del ROW_CACHE[user_id]
+
+FLUSH_DELAY = 0.5  # seconds to collect changes before writing them
+FLUSH_RETRY_DELAY = 5  # seconds to wait after a failed write (e.g. disk full)
+_dirty_users = set()
+_flush_task = None
+
+def take_pending():
+    """Snapshot the changed players as (ids, rows to upsert, ids to delete)"""
+    pending = list(_dirty_users)
+    _dirty_users.clear()
+    rows = [stats_to_row(user_id, STATS[user_id]) for user_id in pending if user_id in STATS]
+    deleted_ids = [user_id for user_id in pending if user_id not in STATS]
+    return pending, rows, deleted_ids
+
+def write_pending(pending, rows, deleted_ids):
+    """Write a take_pending() snapshot in one transaction (safe to run in a thread)"""
+    if not pending:
+        return True
+    if not write_users(rows, deleted_ids):
+        return False
+    logger.info(f"💾 Saved {len(pending)} players")
+    return True
+
+def flush_stats():
+    """Write all changed players to the database and sync it to disk (on shutdown)"""
+    if not write_pending(*take_pending()):
+        return
+    
+    # synchronous=NORMAL only fsyncs the WAL at checkpoints, so force one
+    try:
+        busy = db.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Checkpoint error: {e}")
+        return
+    if busy:
+        logger.error("Checkpoint error: database busy, last changes may not be synced")
+
+async def _delayed_flush():
+    # Loops because players marked while a write is in the thread need another
+    # pass, and a failed write is retried here instead of waiting for a command
+    delay = FLUSH_DELAY
+    while _dirty_users:
+        await asyncio.sleep(delay)
+        # The snapshot is taken on the event loop, only the SQLite work runs in a thread
+        batch = take_pending()
+        if await asyncio.to_thread(write_pending, *batch):
+            delay = FLUSH_DELAY
+        else:
+            _dirty_users.update(batch[0])  # retried on the next pass
+            delay = FLUSH_RETRY_DELAY
+
+def mark_dirty(user_id):
+    """Queue a player for the next flush"""
+    global _flush_task
+    _dirty_users.add(user_id)
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_delayed_flush())
+
+def get_user(user_id):
+    """Get one player's stats (None if not registered)"""
+    return STATS.get(user_id)
+
+def all_users():
+    """Get all players as {user_id: stats}"""
+    return STATS
+
+def top_users():
+    """Get players ordered by total power as [(user_id, stats)]"""
+    return [(user_id, STATS[user_id]) for _, user_id in reversed(RANKING)]
+
+def power_summary():
+    """Get (player count, total power)"""
+    return len(STATS), TOTAL_POWER
+
+def save_user(user_id, data):
+    """Replace a player's stats"""
+    old_data = STATS.get(user_id)
+    if old_data == data:
+        return  # identical record, nothing to write
+    if old_data is not None:
+        _unindex(user_id, old_data)
+    STATS[user_id] = data
+    _index(user_id, data)
+    mark_dirty(user_id)
+
+def update_user(user_id, **changes):
+    """Change some stats of a registered player"""
+    data = STATS.get(user_id)
+    if data is None:
+        return
+    if all(data.get(key) == value for key, value in changes.items()):
+        return  # e.g. "!setskin yes" twice, nothing to write
+    _unindex(user_id, data)
+    data.update(changes)
+    _index(user_id, data)
+    mark_dirty(user_id)
+
+def remove_user(user_id):
+    """Delete a player"""
+    data = STATS.pop(user_id, None)
+    if data is None:
+        return
+    _unindex(user_id, data)
+    mark_dirty(user_id)
+
 # ========== SHUTDOWN HANDLING ==========
 def shutdown_handler():
     logger.info("🔄 Graceful shutdown")
+    flush_stats()
 
-def signal_handler(sig, frame):
-    logger.info(f"Signal {sig}, shutting down...")
-    shutdown_handler()
-    sys.exit(0)
+async def graceful_shutdown(sig):
+    """Close the bot from the event loop; bot.run() returns and atexit flushes"""
+    logger.info(f"Signal {sig.name}, shutting down...")
+    await bot.close()
 
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
 atexit.register(shutdown_handler)
 
 # ========== BOT EVENTS ==========
+_presence_count = None  # player count shown in the current presence
+
 @bot.event
 async def on_ready():
-    stats = load_stats()
-    total_power = sum(calculate_total(s) for s in stats.values())
+    global _presence_count
+    player_count, total_power = power_summary()
     
     logger.info(f"🤖 {bot.user} is ready!")
-    logger.info(f"📊 {len(bot.guilds)} guilds | {len(stats)} players | 💪 {total_power:,} power")
+    logger.info(f"📊 {len(bot.guilds)} guilds | {player_count} players | 💪 {total_power:,} power")
     
-    await bot.change_presence(
-        activity=discord.Activity(
-            type=discord.ActivityType.watching,
-            name=f"{len(stats)} players | !commands"
-        )
+    # on_ready fires again after every reconnect, but bot.activity is re-sent on
+    # identify, so only push a new presence when the player count moved
+    if player_count == _presence_count:
+        return
+    _presence_count = player_count
+    bot.activity = discord.Activity(
+        type=discord.ActivityType.watching,
+        name=f"{player_count} players | !commands"
     )
+    await bot.change_presence(activity=bot.activity)
 
 @bot.event
 async def on_message(message):
-    if message.author == bot.user:
+    # Most messages are chat, so skip the command parser for them (and for bots, incl. ourselves)
+    if message.author.bot or not message.content.startswith(bot.command_prefix):
         return
     await bot.process_commands(message)
 
@@ -177,7 +483,8 @@ async def on_command_error(ctx, error):
     raise error
 
 # ========== HELPER FUNCTIONS ==========
-async def send_help(user):
+def build_help_embed():
+    """Build the (static) help embed, done once at startup"""
     embed = discord.Embed(
         title="🤖 GuildStats Bot - Commands",
         description="**DM only for privacy**",
@@ -203,27 +510,39 @@ async def send_help(user):
     for cmd, desc in commands_list:
         embed.add_field(name=cmd, value=desc, inline=False)
     
-    await user.send(embed=embed)
+    return embed
+
+HELP_EMBED = build_help_embed()
+
+async def fetch_members(guild, user_ids):
+    """Get the guild members among user_ids as {user_id: member} (100 per gateway request)"""
+    user_ids = list(user_ids)
+    members = {}
+    for start in range(0, len(user_ids), 100):
+        batch = user_ids[start:start + 100]
+        for member in await guild.query_members(user_ids=batch, limit=len(batch), cache=False):
+            members[member.id] = member
+    return members
+
+_timestamp_cache = [0, '']  # [epoch second, ISO string]
+
+def iso_now():
+    """Local time as ISO string at one-second resolution (formatted once per second)"""
+    now = int(time.time())
+    if now != _timestamp_cache[0]:
+        _timestamp_cache[0] = now
+        _timestamp_cache[1] = datetime.fromtimestamp(now).isoformat()
+    return _timestamp_cache[1]
+
+async def send_help(user):
+    await user.send(embed=HELP_EMBED)
 
 def normalize_class_name(input_class):
     if not input_class:
         return None
     
-    input_lower = input_class.lower().strip()
-    
-    if input_lower in CLASS_MAPPING:
-        return CLASS_MAPPING[input_lower]
-    
-    simple_input = input_lower.replace(" ", "").replace("-", "")
-    if simple_input in CLASS_MAPPING:
-        return CLASS_MAPPING[simple_input]
-    
-    if "night" in input_lower and "ranger" in input_lower:
-        return "Night Ranger"
-    if "divine" in input_lower and "caster" in input_lower:
-        return "Divine Caster"
-    
-    return None
+    key = input_class.lower().strip()
+    return CLASS_MAPPING.get(key) or CLASS_MAPPING.get(NON_LETTERS.sub('', key))
 
 # ========== COMMANDS ==========
 @bot.command(name='commands')
@@ -237,7 +556,7 @@ async def test_command(ctx):
 @bot.command(name='status')
 @commands.check(is_high_council_only)
 async def status_command(ctx):
-    stats = load_stats()
+    player_count, total_power = power_summary()
     
     embed = discord.Embed(
         title="🤖 Bot Status",
@@ -245,12 +564,11 @@ async def status_command(ctx):
     )
     
     embed.add_field(name="🏓 Ping", value=f"{round(bot.latency * 1000)}ms", inline=True)
-    embed.add_field(name="📊 Players", value=str(len(stats)), inline=True)
-    embed.add_field(name="💾 Storage", value="Railway Volume" if '/data' in STATS_FILE else "Local", inline=True)
+    embed.add_field(name="📊 Players", value=str(player_count), inline=True)
+    embed.add_field(name="💾 Storage", value="Railway Volume" if ON_VOLUME else "Local", inline=True)
     
-    total_power = sum(calculate_total(s) for s in stats.values())
-    if stats:
-        avg_power = total_power / len(stats)
+    if player_count:
+        avg_power = total_power / player_count
         embed.add_field(name="⚡ Total Power", value=f"{total_power:,}", inline=True)
         embed.add_field(name="📈 Average", value=f"{avg_power:,.1f}", inline=True)
     
@@ -264,9 +582,7 @@ async def set_stats(ctx, attack: int, defense: int, accuracy: int, *, character_
         await ctx.send(f'❌ Invalid class. Available: {", ".join(AVAILABLE_CLASSES)}')
         return
     
-    stats = load_stats()
-    user_id = str(ctx.author.id)
-    
+    total = attack + defense + accuracy
     user_data = {
         'attack': attack,
         'defense': defense,
@@ -274,40 +590,35 @@ async def set_stats(ctx, attack: int, defense: int, accuracy: int, *, character_
         'character_class': normalized_class,
         'legendary_skin': False,
         'legendary_familiar': False,
-        'total_score': attack + defense + accuracy,
-        'updated_at': datetime.now().isoformat()
+        'total_score': total,
+        'updated_at': iso_now(),
+        'username': ctx.author.name,
+        'display_name': ctx.author.display_name
     }
     
-    stats[user_id] = user_data
+    save_user(ctx.author.id, user_data)
+    embed = discord.Embed(title="✅ Statistics Saved!", color=discord.Color.green())
+    embed.add_field(name="⚔️ Attack", value=str(attack), inline=True)
+    embed.add_field(name="🛡️ Defense", value=str(defense), inline=True)
+    embed.add_field(name="🎯 Accuracy", value=str(accuracy), inline=True)
     
-    if save_stats(stats):
-        embed = discord.Embed(title="✅ Statistics Saved!", color=discord.Color.green())
-        embed.add_field(name="⚔️ Attack", value=str(attack), inline=True)
-        embed.add_field(name="🛡️ Defense", value=str(defense), inline=True)
-        embed.add_field(name="🎯 Accuracy", value=str(accuracy), inline=True)
-        
-        if normalized_class:
-            embed.add_field(name="🏆 Class", value=normalized_class, inline=True)
-        
-        total = attack + defense + accuracy
-        embed.add_field(name="💪 Total", value=str(total), inline=True)
-        embed.set_footer(text="Use !mystats to view")
-        
-        await ctx.send(embed=embed)
-    else:
-        await ctx.send('❌ Error saving. Try again.')
+    if normalized_class:
+        embed.add_field(name="🏆 Class", value=normalized_class, inline=True)
+    
+    embed.add_field(name="💪 Total", value=str(total), inline=True)
+    embed.set_footer(text="Use !mystats to view")
+    
+    await ctx.send(embed=embed)
 
 @bot.command(name='mystats')
 async def my_stats(ctx):
-    user_id = str(ctx.author.id)
-    stats = load_stats()
+    data = get_user(ctx.author.id)
     
-    if user_id not in stats:
+    if data is None:
         await ctx.send('❌ No statistics. Use `!setstats` first.')
         return
     
-    data = stats[user_id]
-    total = calculate_total(data)
+    total = data['total_score']
     
     embed = discord.Embed(title="📊 Your Statistics", color=discord.Color.blue())
     embed.add_field(name="⚔️ Attack", value=str(data['attack']), inline=True)
@@ -337,20 +648,15 @@ async def set_skin(ctx, has_skin: str = None):
         return
     
     skin_bool = has_skin_lower in ['yes', 'tak']
-    user_id = str(ctx.author.id)
-    stats = load_stats()
+    user_id = ctx.author.id
     
-    if user_id not in stats:
+    if get_user(user_id) is None:
         await ctx.send('❌ First use `!setstats`')
         return
     
-    stats[user_id]['legendary_skin'] = skin_bool
-    
-    if save_stats(stats):
-        message = "✅ You have" if skin_bool else "❌ You don't have"
-        await ctx.send(f'{message} **Legendary Skin**')
-    else:
-        await ctx.send('❌ Error saving.')
+    update_user(user_id, legendary_skin=skin_bool)
+    message = "✅ You have" if skin_bool else "❌ You don't have"
+    await ctx.send(f'{message} **Legendary Skin**')
 
 @bot.command(name='setfamiliar')
 async def set_familiar(ctx, has_familiar: str = None):
@@ -364,20 +670,15 @@ async def set_familiar(ctx, has_familiar: str = None):
         return
     
     familiar_bool = has_familiar_lower in ['yes', 'tak']
-    user_id = str(ctx.author.id)
-    stats = load_stats()
+    user_id = ctx.author.id
     
-    if user_id not in stats:
+    if get_user(user_id) is None:
         await ctx.send('❌ First use `!setstats`')
         return
     
-    stats[user_id]['legendary_familiar'] = familiar_bool
-    
-    if save_stats(stats):
-        message = "✅ You have" if familiar_bool else "❌ You don't have"
-        await ctx.send(f'{message} **Legendary Familiar**')
-    else:
-        await ctx.send('❌ Error saving.')
+    update_user(user_id, legendary_familiar=familiar_bool)
+    message = "✅ You have" if familiar_bool else "❌ You don't have"
+    await ctx.send(f'{message} **Legendary Familiar**')
 
 @bot.command(name='setclass')
 async def set_class(ctx, *, character_class: str = None):
@@ -390,61 +691,49 @@ async def set_class(ctx, *, character_class: str = None):
         await ctx.send(f'❌ Invalid class. Available: {", ".join(AVAILABLE_CLASSES)}')
         return
     
-    user_id = str(ctx.author.id)
-    stats = load_stats()
+    user_id = ctx.author.id
     
-    if user_id not in stats:
+    if get_user(user_id) is None:
         await ctx.send('❌ First use `!setstats`')
         return
     
-    stats[user_id]['character_class'] = normalized_class
-    
-    if save_stats(stats):
-        await ctx.send(f'✅ Class set to: **{normalized_class}**')
-    else:
-        await ctx.send('❌ Error saving.')
+    update_user(user_id, character_class=normalized_class)
+    await ctx.send(f'✅ Class set to: **{normalized_class}**')
 
 @bot.command(name='update')
 async def update_stats(ctx, attack: int = None, defense: int = None, accuracy: int = None):
-    user_id = str(ctx.author.id)
-    stats = load_stats()
+    user_id = ctx.author.id
+    user_data = get_user(user_id)
     
-    if user_id not in stats:
+    if user_data is None:
         await ctx.send('❌ No statistics. Use `!setstats` first.')
         return
     
-    updated = False
+    changes = {}
     if attack is not None:
-        stats[user_id]['attack'] = attack
-        updated = True
+        changes['attack'] = attack
     if defense is not None:
-        stats[user_id]['defense'] = defense
-        updated = True
+        changes['defense'] = defense
     if accuracy is not None:
-        stats[user_id]['accuracy'] = accuracy
-        updated = True
+        changes['accuracy'] = accuracy
     
-    if not updated:
+    if not changes:
         await ctx.send('❌ No changes provided.')
         return
     
-    stats[user_id]['total_score'] = calculate_total(stats[user_id])
-    stats[user_id]['updated_at'] = datetime.now().isoformat()
-    
-    if save_stats(stats):
-        embed = discord.Embed(title="✅ Updated", color=discord.Color.green())
-        if attack is not None:
-            embed.add_field(name="⚔️ Attack", value=str(attack), inline=True)
-        if defense is not None:
-            embed.add_field(name="🛡️ Defense", value=str(defense), inline=True)
-        if accuracy is not None:
-            embed.add_field(name="🎯 Accuracy", value=str(accuracy), inline=True)
-        
-        total = calculate_total(stats[user_id])
-        embed.add_field(name="💪 New Total", value=str(total), inline=False)
-        await ctx.send(embed=embed)
-    else:
-        await ctx.send('❌ Error saving.')
+    total = calculate_total({**user_data, **changes})
+    
+    update_user(user_id, **changes, total_score=total, updated_at=iso_now())
+    embed = discord.Embed(title="✅ Updated", color=discord.Color.green())
+    if attack is not None:
+        embed.add_field(name="⚔️ Attack", value=str(attack), inline=True)
+    if defense is not None:
+        embed.add_field(name="🛡️ Defense", value=str(defense), inline=True)
+    if accuracy is not None:
+        embed.add_field(name="🎯 Accuracy", value=str(accuracy), inline=True)
+    
+    embed.add_field(name="💪 New Total", value=str(total), inline=False)
+    await ctx.send(embed=embed)
 
 @bot.command(name='guildpower')
 @commands.check(is_high_council_only)
@@ -453,20 +742,19 @@ async def guild_power(ctx):
         await ctx.send('❌ Use on server channel.')
         return
     
-    stats = load_stats()
+    stats = all_users()
     
     if not stats:
         await ctx.send('📊 No statistics yet.')
         return
     
-    total_power = 0
-    member_count = 0
+    # Snapshot before awaiting the gateway, a !clearmystats may run meanwhile
+    scores = {user_id: data['total_score'] for user_id, data in stats.items()}
+    skin_count, familiar_count = SKIN_COUNT, FAMILIAR_COUNT
     
-    for user_id, user_stats in stats.items():
-        member = ctx.guild.get_member(int(user_id))
-        if member:
-            total_power += calculate_total(user_stats)
-            member_count += 1
+    active_ids = (await fetch_members(ctx.guild, scores)).keys()
+    member_count = len(active_ids)
+    total_power = sum(scores[user_id] for user_id in active_ids)
     
     if member_count == 0:
         await ctx.send('📊 No active members.')
@@ -484,9 +772,6 @@ async def guild_power(ctx):
     embed.add_field(name="⚡ Total", value=f"{total_power:,}", inline=True)
     embed.add_field(name="📊 Average", value=f"{avg_power:,.1f}", inline=True)
     
-    skin_count = sum(1 for data in stats.values() if data.get('legendary_skin', False))
-    familiar_count = sum(1 for data in stats.values() if data.get('legendary_familiar', False))
-    
     embed.add_field(name="✨ Skins", value=str(skin_count), inline=True)
     embed.add_field(name="🐉 Familiars", value=str(familiar_count), inline=True)
     embed.set_footer(text="High Council command")
@@ -501,30 +786,35 @@ async def list_stats(ctx):
         await ctx.send('❌ Use on server channel.')
         return
     
-    stats = load_stats()
+    # Snapshot rows and scores before awaiting the gateway, players may be
+    # updated or removed meanwhile
+    ranking = [
+        (user_id, ROW_CACHE[user_id], data['total_score'], data['legendary_skin'], data['legendary_familiar'])
+        for user_id, data in top_users()
+    ]
     
-    if not stats:
+    if not ranking:
         await ctx.send('📊 No statistics.')
         return
     
+    members = await fetch_members(ctx.guild, (user_id for user_id, *_ in ranking))
+    
+    # Already ordered by total power; totals are summed in the same pass
     active_players = []
-    for user_id, user_data in stats.items():
-        member = ctx.guild.get_member(int(user_id))
+    total_guild_power = skin_count = familiar_count = 0
+    for user_id, row, total, skin, familiar in ranking:
+        member = members.get(user_id)
         if member:
-            active_players.append({
-                'member': member,
-                'stats': user_data,
-                'total': calculate_total(user_data)
-            })
+            active_players.append({'member': member, 'row': row})
+            total_guild_power += total
+            skin_count += skin
+            familiar_count += familiar
     
     if not active_players:
         await ctx.send('📊 No active players.')
         return
     
-    active_players.sort(key=lambda x: x['total'], reverse=True)
-    
     total_players = len(active_players)
-    total_guild_power = sum(player['total'] for player in active_players)
     avg_power = total_guild_power / total_players if total_players else 0
     
     # SPRAWDŹ CZY WSZYSCY SIĘ MIESZCZĄ W JEDNYM EMBED (max 20 dla bezpieczeństwa)
@@ -537,40 +827,28 @@ async def list_stats(ctx):
         )
         
         for i, player in enumerate(active_players, 1):
-            icons = ""
-            if player['stats'].get('legendary_skin', False):
-                icons += "✨"
-            if player['stats'].get('legendary_familiar', False):
-                icons += "🐉"
+            icons, value = player['row']
             
             medal = ""
             if i == 1: medal = "👑 "
             elif i == 2: medal = "🥈 "
             elif i == 3: medal = "🥉 "
             
-            class_text = player['stats'].get('character_class', '❓')
-            atk = player['stats'].get('attack', 0)
-            df = player['stats'].get('defense', 0)
-            acc = player['stats'].get('accuracy', 0)
-            
             embed.add_field(
                 name=f"{medal}{i}. {player['member'].display_name} {icons}",
-                value=f"**{player['total']:,}** ({atk}/{df}/{acc}) | {class_text}",
+                value=value,
                 inline=False
             )
         
         # Dodaj statystyki footer
-        skin_count = sum(1 for p in active_players if p['stats'].get('legendary_skin', False))
-        familiar_count = sum(1 for p in active_players if p['stats'].get('legendary_familiar', False))
-        
         embed.set_footer(text=f"✨ {skin_count} skins • 🐉 {familiar_count} familiars • All players shown")
         await ctx.send(embed=embed)
     
     else:
         # Za dużo graczy - automatycznie wyślij multiple embeds
-        await send_multi_page_list(ctx, active_players, total_guild_power, avg_power)
+        await send_multi_page_list(ctx, active_players, total_guild_power, avg_power, skin_count, familiar_count)
 
-async def send_multi_page_list(ctx, players, total_power, avg_power):
+async def send_multi_page_list(ctx, players, total_power, avg_power, skin_count, familiar_count):
     """Send multiple embeds automatically when there are more than 20 players"""
     total_players = len(players)
     
@@ -581,9 +859,6 @@ async def send_multi_page_list(ctx, players, total_power, avg_power):
         color=discord.Color.purple()
     )
     
-    skin_count = sum(1 for p in players if p['stats'].get('legendary_skin', False))
-    familiar_count = sum(1 for p in players if p['stats'].get('legendary_familiar', False))
-    
     summary_embed.add_field(name="📊 Summary", value=f"✨ {skin_count} skins • 🐉 {familiar_count} familiars", inline=False)
     
     total_pages = (total_players + 19) // 20  # 20 graczy na stronę
@@ -607,26 +882,16 @@ async def send_multi_page_list(ctx, players, total_power, avg_power):
         for i in range(start_idx, end_idx):
             player = players[i]
             rank = i + 1
-            
-            icons = ""
-            if player['stats'].get('legendary_skin', False):
-                icons += "✨"
-            if player['stats'].get('legendary_familiar', False):
-                icons += "🐉"
+            icons, value = player['row']
             
             medal = ""
             if rank == 1: medal = "👑 "
             elif rank == 2: medal = "🥈 "
             elif rank == 3: medal = "🥉 "
             
-            class_text = player['stats'].get('character_class', '❓')
-            atk = player['stats'].get('attack', 0)
-            df = player['stats'].get('defense', 0)
-            acc = player['stats'].get('accuracy', 0)
-            
             embed.add_field(
                 name=f"{medal}{rank}. {player['member'].display_name} {icons}",
-                value=f"**{player['total']:,}** ({atk}/{df}/{acc}) | {class_text}",
+                value=value,
                 inline=False
             )
         
@@ -644,54 +909,53 @@ async def send_multi_page_list(ctx, players, total_power, avg_power):
 
 @bot.command(name='clearmystats')
 async def clear_stats(ctx):
-    user_id = str(ctx.author.id)
-    stats = load_stats()
+    user_id = ctx.author.id
     
-    if user_id in stats:
-        del stats[user_id]
-        if save_stats(stats):
-            await ctx.send('✅ Statistics deleted.')
-        else:
-            await ctx.send('❌ Error deleting.')
+    if get_user(user_id) is not None:
+        remove_user(user_id)
+        await ctx.send('✅ Statistics deleted.')
     else:
         await ctx.send('❌ No statistics to delete.')
 
 @bot.command(name='storage')
 async def storage_command(ctx):
-    stats = load_stats()
+    player_count, total_power = power_summary()
     
     embed = discord.Embed(
         title="💾 Storage Information",
         color=discord.Color.blue()
     )
     
-    embed.add_field(name="📍 Path", value=STATS_FILE, inline=False)
-    embed.add_field(name="👥 Players", value=str(len(stats)), inline=True)
-    embed.add_field(name="💪 Total Power", value=f"{sum(calculate_total(s) for s in stats.values()):,}", inline=True)
+    embed.add_field(name="📍 Path", value=DB_FILE, inline=False)
+    embed.add_field(name="👥 Players", value=str(player_count), inline=True)
+    embed.add_field(name="💪 Total Power", value=f"{total_power:,}", inline=True)
     
-    if '/data' in STATS_FILE:
+    if ON_VOLUME:
         embed.add_field(name="✅ Type", value="Railway Volume (Persistent)", inline=True)
     else:
         embed.add_field(name="⚠️ Type", value="Local file", inline=True)
     
-    if os.path.exists(STATS_FILE):
-        size = os.path.getsize(STATS_FILE)
+    try:
+        size = os.path.getsize(DB_FILE)
         embed.add_field(name="📁 File Size", value=f"{size:,} bytes", inline=True)
+    except OSError:
+        pass
     
     await ctx.send(embed=embed)
 
 @bot.command(name='backup')
 async def backup_command(ctx):
-    stats = load_stats()
+    # Copied so the dump in the worker thread can't see commands changing STATS;
+    # json.dump writes the int ids as string keys
+    stats = {user_id: dict(data) for user_id, data in all_users().items()}
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_file = f'backup_{timestamp}.json'
-    
-    with open(backup_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'backup_date': datetime.now().isoformat(),
-            'player_count': len(stats),
-            'data': stats
-        }, f, indent=2)
+    backup_file = f'backup_{timestamp}.json.gz'
+    
+    await asyncio.to_thread(write_backup, backup_file, {
+        'backup_date': datetime.now().isoformat(),
+        'player_count': len(stats),
+        'data': stats
+    })
     
     await ctx.send(f'✅ Backup created: `{backup_file}` with {len(stats)} players')
 